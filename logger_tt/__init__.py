@@ -2,6 +2,7 @@ import json
 import logging
 import sys
 import threading
+from functools import lru_cache, partial
 from logging import getLogger
 from logging.config import dictConfig
 from multiprocessing import current_process
@@ -11,6 +12,11 @@ from typing import *
 from .core import DefaultFormatter, LogConfig
 from .inspector import analyze_exception_recur, logging_disabled
 
+try:
+    import orjson  # optional, decodes json config faster
+except ImportError:
+    orjson = None
+
 __author__ = "Duc Tin"
 __all__ = ['setup_logging', 'logging_disabled', 'getLogger', 'logger']
 
@@ -35,7 +41,12 @@ def handle_exception(exc_type, exc_value, exc_traceback, thread_name=''):
     if thread_name:
         thread_name = ' in ' + thread_name
 
-    logging.error(f"Uncaught exception{thread_name}:\n{txt}")
+    # build and hand the record to the root logger directly, skipping the caller lookup of logging.error
+    root = logging.getLogger()
+    if root.isEnabledFor(logging.ERROR):
+        record = root.makeRecord(root.name, logging.ERROR, __file__, sys._getframe().f_lineno,
+                                 f"Uncaught exception{thread_name}:\n{txt}", (), None, 'handle_exception')
+        root.handle(record)
 
     if not thread_name:
         # As interpreter is going to shutdown after this function,
@@ -67,6 +78,7 @@ def ensure_path(config: Dict[str, Dict[str, dict]], override_log_paths: Union[st
     if `override_log_paths` is `dict` in the form of `{handler_name: log_path, ...}`,
     overwrite filename for respective handler with the dict value
     """
+    log_paths = set()
     for handler_name, handler in config['handlers'].items():
         filename = handler.get('filename')
         if not filename:
@@ -77,25 +89,38 @@ def ensure_path(config: Dict[str, Dict[str, dict]], override_log_paths: Union[st
             override = override_log_paths.get(handler_name)
         filename = override or filename
         handler['filename'] = filename
-        log_path = Path(filename).parent
+        log_paths.add(Path(filename).parent)
+
+    # handlers usually share the same log folder, create it once
+    for log_path in log_paths:
         log_path.mkdir(parents=True, exist_ok=True)
 
 
-def load_from_file(f: Path) -> dict:
-    if f.suffix in ['.yaml', '.yml']:
+@lru_cache(maxsize=None)
+def get_yaml_loader() -> Callable[[str], Any]:
+    """Return the yaml parsing function, resolved once.
+        The libyaml C loader of pyyaml is preferred, then its pure python loader, then ruamel.yaml
+    """
+    try:
+        import yaml  # will raise error if pyyaml is not installed
+    except ImportError:
         try:
-            import yaml  # will raise error if pyyaml is not installed
-            safe_load = yaml.safe_load
+            from ruamel.yaml import YAML
         except ImportError:
-            try:
-                from ruamel.yaml import YAML
-                yaml = YAML(typ='safe')
-                safe_load = yaml.load
-            except ImportError:
-                raise ImportError('Required package not found: "pyyaml" or "ruamel.yaml"')
+            raise ImportError('Required package not found: "pyyaml" or "ruamel.yaml"')
+        return YAML(typ='safe').load
+
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    return partial(yaml.load, Loader=loader)
+
 
+def load_from_file(f: Path) -> dict:
+    if f.suffix in ['.yaml', '.yml']:
+        safe_load = get_yaml_loader()
         dict_cfg = safe_load(f.read_text())
 
+    elif orjson:
+        dict_cfg = orjson.loads(f.read_bytes())
     else:
         with f.open() as fp:
             dict_cfg = json.load(fp)
@@ -121,7 +146,7 @@ def merge_config(from_file: dict, from_func: dict) -> dict:
                     full_context=0, suppress=None,
                     suppress_level_below=logging.WARNING, use_multiprocessing=False,
                     limit_line_length=1000, analyze_raise_statement=False,
-                    host=None, port=None,
+                    host=None, port=None, capture_uncaught=True,
                     )
     merged = {}
     for key, val in defaults.items():
@@ -181,6 +206,8 @@ def setup_logging(config_path: str = "", log_path: str = "", **logger_tt_config)
         :key analyze_raise_statement: bool, should the variables in `raise` exception line be shown or not.
         :key host: str, default to 'localhost'. Used in multiprocessing logging
         :key port: int, default to logging.handlers.DEFAULT_TCP_LOGGING_PORT. Used in multiprocessing logging
+        :key capture_uncaught: bool, default to True. Log uncaught exceptions of the main thread and child threads.
+                                Set to False to keep the current `sys.excepthook` and `threading.Thread.run`
     """
 
     if config_path:
@@ -228,8 +255,9 @@ def setup_logging(config_path: str = "", log_path: str = "", **logger_tt_config)
         raise
 
     # capture other messages
-    sys.excepthook = handle_exception
-    threading.Thread.run = thread_run_with_exception_logging
+    if iconfig['capture_uncaught']:
+        sys.excepthook = handle_exception
+        threading.Thread.run = thread_run_with_exception_logging
     return internal_config
 
 
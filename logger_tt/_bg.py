@@ -0,0 +1,72 @@
+import asyncio
+import os
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Thread, Lock
+
+__author__ = "Duc Tin"
+
+"""One daemon thread running an asyncio event loop that serves the periodic jobs of all handlers"""
+
+# Threads running the blocking periodic jobs (watchers, pushers) of all handlers.
+# Each job runs one call at a time, so this many jobs can be stuck on I/O before the others have to wait.
+# Nothing else uses this pool: a job may wait for work done in another pool, never for work queued here.
+PERIODIC_WORKERS = 8
+
+_loop = None        # type: asyncio.AbstractEventLoop
+_executor = None    # type: ThreadPoolExecutor
+_loop_lock = Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Return the shared event loop. It is started in a daemon thread on first use"""
+    global _loop, _executor
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            _executor = ThreadPoolExecutor(max_workers=PERIODIC_WORKERS, thread_name_prefix='logger_tt_periodic')
+            Thread(target=loop.run_forever, name='logger_tt_background', daemon=True).start()
+            _loop = loop
+
+    return _loop
+
+
+def _reset_loop():
+    """The loop thread doesn't survive a fork, the child process has to start its own"""
+    global _loop, _executor, _loop_lock
+    _loop = None
+    _executor = None
+    _loop_lock = Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_loop)
+
+
+async def _periodic(interval: float, callback, blocking: bool):
+    loop = get_loop()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if blocking:
+                # keep the loop free for other handlers while this one waits for I/O
+                try:
+                    job = loop.run_in_executor(_executor, callback)
+                except RuntimeError:
+                    # the interpreter is shutting down, the handlers are flushed at exit anyway
+                    return
+                await job
+            else:
+                callback()
+        except Exception:
+            traceback.print_exc()
+
+
+def call_every(interval: float, callback, blocking: bool = False) -> Future:
+    """Call `callback` every `interval` seconds in the background until the returned future is cancelled.
+
+    :param interval: seconds to wait between two calls
+    :param callback: function without argument
+    :param blocking: True if the callback does blocking I/O, it is then run in a pool of PERIODIC_WORKERS threads
+    """
+    return asyncio.run_coroutine_threadsafe(_periodic(interval, callback, blocking), get_loop())
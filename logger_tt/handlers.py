@@ -1,11 +1,83 @@
 import logging
+import signal
+import sys
 import time
 import os
 import json
-from urllib import request, parse, error
+import traceback
+from http.client import HTTPSConnection, HTTPException, RemoteDisconnected
+from urllib import parse
 from collections import deque
-from threading import Thread, Event
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from datetime import datetime
+from threading import Lock, current_thread, main_thread
+
+from . import _bg
+
+
+class _QuotePlusTable(dict):
+    """str.translate table mapping each character to its parse.quote_plus.
+        Non-ascii characters are quoted on first sight and cached,
+        only those in the BMP so that the table can't grow beyond 65536 entries.
+    """
+
+    def __missing__(self, code_point):
+        quoted = parse.quote_plus(chr(code_point))
+        if code_point < 0x10000:
+            self[code_point] = quoted
+        return quoted
+
+
+# all ascii characters are included, even the safe ones, to keep str.translate on its fast path
+_QUOTE_PLUS_ASCII = {i: parse.quote_plus(chr(i)) for i in range(128)}
+_QUOTE_PLUS_ALL = _QuotePlusTable(_QUOTE_PLUS_ASCII)
+
+
+if hasattr(str, 'isascii'):
+    _isascii = str.isascii
+else:
+    # python 3.6
+    def _isascii(text: str) -> bool:
+        try:
+            text.encode('ascii')
+        except UnicodeEncodeError:
+            return False
+        return True
+
+
+def quote_plus(text: str) -> str:
+    """Same as parse.quote_plus but done by a single str.translate"""
+    if _isascii(text):
+        return text.translate(_QUOTE_PLUS_ASCII)
+    return text.translate(_QUOTE_PLUS_ALL)
+
+
+def record_signature(record: logging.LogRecord) -> tuple:
+    """Records with the same signature are considered as the same repeated log message"""
+    return record.msg, record.name, record.levelno, record.pathname, record.lineno, record.args, record.funcName
+
+
+_sigterm_pid = None     # process that installed _flush_on_sigterm
+
+
+def _flush_on_sigterm(signum, frame):
+    if os.getpid() == _sigterm_pid:
+        # a forked child process inherits this handler, but the buffered logs belong to its parent
+        logging.shutdown()
+
+    # then terminate as if this handler was never installed
+    signal.signal(signum, signal.SIG_DFL)
+    os.kill(os.getpid(), signum)
+
+
+def flush_on_sigterm():
+    """If SIGTERM is not handled by anyone yet, flush the handlers by logging.shutdown when it comes.
+        The signal then terminates the process as usual.
+    """
+    global _sigterm_pid
+    if current_thread() is main_thread() and signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+        _sigterm_pid = os.getpid()
+        signal.signal(signal.SIGTERM, _flush_on_sigterm)
 
 
 class StreamHandlerWithBuffer(logging.StreamHandler):
@@ -15,69 +87,129 @@ class StreamHandlerWithBuffer(logging.StreamHandler):
 
         self.buffer_time = buffer_time
         self.buffer_lines = buffer_lines
-        self.buffer = []
         self.debug = debug
 
-        self._stop_event = Event()
+        # messages are encoded as soon as they come in, so flushing is a single write
+        self.buffer = bytearray()
+        self.lines = 0
+        self._encoding = getattr(self.stream, 'encoding', None) or 'utf-8'
+        self._errors = getattr(self.stream, 'errors', None) or 'surrogatepass'
+        self._terminator = self.terminator.encode(self._encoding)
+
+        self._watcher = None
         if self.buffer_time:
-            watcher = Thread(target=self.watcher, daemon=True)
-            watcher.start()
+            if self.debug:
+                self._append(f'StreamHandlerWithBuffer watcher starts: {datetime.now()}')
+            # it waits for the lock and the stream, keep that off the loop shared by all handlers
+            self._watcher = _bg.call_every(self.buffer_time, self.watcher, blocking=True)
+
+        # don't lose the buffered lines when the program is terminated before the next flush
+        flush_on_sigterm()
+
+    @property
+    def buffer_lines(self) -> int:
+        return self._buffer_lines
+
+    @buffer_lines.setter
+    def buffer_lines(self, value: int):
+        self._buffer_lines = value
+        # chosen here instead of checking buffer_lines on every record
+        self._emit = self._emit_counted if value else self._emit_time_only
+
+    @property
+    def debug(self) -> bool:
+        return self._debug
+
+    @debug.setter
+    def debug(self, value: bool):
+        self._debug = value
+        # chosen here instead of checking debug on every flush
+        self._export = self._export_debug if value else self._export_plain
 
     def close(self) -> None:
-        self._stop_event.set()
+        """Stop the background flushing and write out the lines left in the buffer"""
+        if self._watcher:
+            self._watcher.cancel()
+        self.flush()
+        super().close()
+
+    def flush(self):
+        """Write out the buffered lines, then flush the stream"""
+        with self.lock:
+            if self.buffer:
+                self.export()
+            else:
+                super().flush()
+
+    def _append(self, msg: str):
+        self.buffer += msg.encode(self._encoding, self._errors)
+        self.buffer += self._terminator
+        self.lines += 1
 
     def export(self):
         """Actual writing data out to the stream"""
+        self._export()
 
-        if self.debug:
-            self.buffer.append(f'StreamHandlerWithBuffer flush: {datetime.now()}')
-
-        msg = self.terminator.join(self.buffer)
+    def _export_plain(self):
         stream = self.stream
-        # issue 35046: merged two stream.writes into one.
-        stream.write(msg + self.terminator)
-        self.flush()
+        raw = getattr(stream, 'buffer', None)
+        if raw is not None and os.linesep == '\n' and getattr(stream, 'encoding', None) == self._encoding:
+            # data is already encoded, write it directly under the text layer
+            stream.flush()
+            raw.write(self.buffer)
+        else:
+            # text only stream, or the stream was replaced by one with another encoding
+            stream.write(self.buffer.decode(self._encoding, self._errors))
+        super().flush()
 
         self.buffer.clear()
+        self.lines = 0
+
+    def _export_debug(self):
+        """Same as _export_plain, also writes out the flushing time"""
+        self._append(f'StreamHandlerWithBuffer flush: {datetime.now()}')
+        self._export_plain()
 
     def emit(self, record):
         """
         Emit a record.
 
         If a formatter is specified, it is used to format the record.
-        The record is then written to the stream with a trailing newline.  If
-        exception information is present, it is formatted using
-        traceback.print_exception and appended to the stream.  If the stream
-        has an 'encoding' attribute, it is used to determine how to do the
-        output to the stream.
+        The record is then encoded and appended to the buffer with a trailing newline.
+        The buffer is written out to the stream when it has enough lines or
+        when the buffer_time has passed.
         """
         try:
-            msg = self.format(record)
-            self.buffer.append(msg)
-            if self.buffer_lines and len(self.buffer) >= self.buffer_lines:
-                self.export()
-
+            self._emit(record)
         except RecursionError:  # See issue 36272
             raise
         except Exception:
             self.handleError(record)
 
+    def _emit_counted(self, record):
+        self._append(self.format(record))
+        if self.lines >= self._buffer_lines:
+            self.export()
+
+    def _emit_time_only(self, record):
+        """Used when buffer_lines is not set, the buffer is only flushed by the watcher"""
+        self._append(self.format(record))
+
     def watcher(self):
         """
-        If buffer_time is used, this method will flush the buffer
-        after every buffer_time seconds has passed.
+        If buffer_time is used, this method is called by the background loop's thread pool
+        to flush the buffer after every buffer_time seconds has passed.
         """
-        if self.debug:
-            self.buffer.append(f'StreamHandlerWithBuffer watcher starts: {datetime.now()}')
-        while not self._stop_event.is_set():
-            time.sleep(self.buffer_time)
-            if self.buffer:
-                self.acquire()
-                self.export()
-                self.release()
+        if self.buffer:
+            self.flush()
 
 
 class TelegramHandler(logging.Handler):
+    joiner = '%0A'          # parse.quote_plus('\n')
+    max_length = 4000       # of the quoted text, telegram allows 4096 characters per message
+    cache_size = 100        # unsent messages kept per chat, the oldest ones are dropped first
+    flush_timeout = 30      # seconds flush() waits for the ongoing sending
+
     def __init__(self, token='', unique_ids=None, env_token_key='', env_unique_ids_key='',
                  debug=False, check_interval=600, grouping_interval=0):
         super().__init__()
@@ -94,51 +226,116 @@ class TelegramHandler(logging.Handler):
         if env_unique_ids_key:
             unique_ids = os.environ.get(env_unique_ids_key, None) or unique_ids
 
+        # keep-alive connections to the telegram server, one per chat
+        self._host = 'api.telegram.org'
+        self._url = f"/bot{token}/sendMessage"
+
         self._unique_ids = []       # type: list[str]
+        self._single_id = None      # the only unique_id, if there is just one
+        self._url_templates = {}    # type: dict[str, str]
         self.set_unique_ids(unique_ids)
 
-        self._url = f"https://api.telegram.org/bot{token}/sendMessage"
+        self._connections = {}      # type: dict[str, HTTPSConnection]
         self.feedback = {x: {} for x in self._unique_ids}
-        self.cache = {x: deque(maxlen=100) for x in self._unique_ids}
+        self.cache = {x: deque(maxlen=self.cache_size) for x in self._unique_ids}
+
+        # reduce sending duplicated log
+        self.last_record = None
+        self._last_signature = None
+        self.dup_count = 0
+
+        # emit only caches the record, sending is done by these threads
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='TelegramHandler')
+        self._sending = Lock()      # only one thread sends at a time to keep the messages in order
+        self._chat_jobs = {}        # type: dict[str, Future]   # chats still being sent after a send() timed out
+        self._pending = False       # new records are cached and a _drain has been submitted
 
-        # background thread resends the log if network error previously
+        # background jobs resend the log if network error previously
         self.debug = debug
         self.check_interval = check_interval
-        self._stop_event = Event()
-        watcher_thread = Thread(target=self.watcher, daemon=True)
-        watcher_thread.start()
+        if self.debug:
+            logging.getLogger().debug(f'TelegramHandler watcher starts: {datetime.now()}')
+        self._watcher = _bg.call_every(self.check_interval, self.watcher, blocking=True)
+        self._pusher = None
         if self.grouping_interval:
-            pusher_thread = Thread(target=self.interval_pusher, daemon=True)
-            pusher_thread.start()
+            if self.debug:
+                logging.getLogger().debug(f'TelegramHandler interval_pusher starts: {datetime.now()}')
+            self._pusher = _bg.call_every(self.push_interval, self.interval_pusher, blocking=True)
 
-        # reduce sending duplicated log
-        self.last_record = None
-        self.dup_count = 0
+        # don't lose the cached messages when the program is terminated before the next sending
+        flush_on_sigterm()
+
+    @property
+    def debug(self) -> bool:
+        return self._debug
+
+    @debug.setter
+    def debug(self, value: bool):
+        self._debug = value
+        # chosen here instead of checking debug on every run
+        self._check = self._check_debug if value else self._check_plain
 
     def format(self, record):
         txt = super().format(record) + getattr(record, 'remark', '')
-        return parse.quote_plus(txt)
+        return quote_plus(txt)
+
+    def _formatted(self, record):
+        """Return the quoted text of the record. It is formatted once when cached and reused on resending"""
+        cached = getattr(record, '_tt_formatted', None)
+        if not cached or cached[0] != id(self):
+            # not formatted yet, or formatted by another TelegramHandler
+            cached = record._tt_formatted = (id(self), self.format(record))
+        return cached[1]
+
+    def _repeated_record(self):
+        """Return a copy of the last record remarked with its repeated times.
+            The last record itself may be still in the cache, waiting to be sent as is.
+        """
+        record = logging.makeLogRecord(self.last_record.__dict__)
+        record.remark = f'\n (Message repeated {self.dup_count} times)'
+        record._tt_formatted = None
+        return record
 
     def close(self) -> None:
-        self._stop_event.set()
-
-    def _get_full_url(self, unique_id: str, text: str):
-        # remove name/label if presence
-        unique_id = unique_id.split(':')[-1]
+        """Stop the background jobs, then send out the messages left in the cache"""
+        # nothing sends after this flush, or it would reopen a connection of a closed handler
+        self._watcher.cancel()
+        if self._pusher:
+            self._pusher.cancel()
+        self._executor.shutdown(wait=False)
+
+        if self.dup_count:
+            self._cache_repeated()
+        self.flush()
 
-        # add message_thread_id if presence
-        if '@' in unique_id:
-            # group_id and topic index is specified
-            chat_id, message_thread_id = unique_id.split('@')
-            url = f'{self._url}?chat_id={chat_id}&message_thread_id={message_thread_id}&text={text}'
-        else:
-            # just chat_id only
-            url = f'{self._url}?chat_id={unique_id}&text={text}'
+        if self._chat_pool:
+            self._chat_pool.shutdown(wait=False)
+        for conn in self._connections.values():
+            conn.close()
+        self._connections.clear()
+        super().close()
+
+    def _build_url_templates(self):
+        """Build the request url of each unique_id once, only the text is left to fill in"""
+        self._url_templates = {}
+        for unique_id in self._unique_ids:
+            # remove name/label if presence
+            chat_id = unique_id.split(':')[-1]
+
+            # add message_thread_id if presence
+            if '@' in chat_id:
+                # group_id and topic index is specified
+                chat_id, message_thread_id = chat_id.split('@')
+                url = f'{self._url}?chat_id={chat_id}&message_thread_id={message_thread_id}'
+            else:
+                # just chat_id only
+                url = f'{self._url}?chat_id={chat_id}'
 
-        return url
+            self._url_templates[unique_id] = url.replace('%', '%%') + '&text=%s'
 
     def set_bot_token(self, token: str):
-        self._url = f"https://api.telegram.org/bot{token}/sendMessage"
+        self._url = f"/bot{token}/sendMessage"
+        self._build_url_templates()
 
     def set_unique_ids(self, ids):
         if not ids:
@@ -152,31 +349,50 @@ class TelegramHandler(logging.Handler):
         else:
             raise TypeError(f'Expected str or int but got type: {type(ids)}')
 
+        self._single_id = self._unique_ids[0] if len(self._unique_ids) == 1 else None
+        self._build_url_templates()
+
+        # one thread per chat to send them concurrently. It is only used by send(),
+        # so a caller of send() never waits for work queued behind itself
+        old_pool = getattr(self, '_chat_pool', None)
+        self._chat_pool = None
+        if len(self._unique_ids) > 1:
+            self._chat_pool = ThreadPoolExecutor(max_workers=len(self._unique_ids),
+                                                 thread_name_prefix='TelegramHandler_chat')
+        if old_pool:
+            old_pool.shutdown(wait=False)
+
+    def _get_connection(self, _id_):
+        conn = self._connections.get(_id_)
+        if conn is None:
+            conn = self._connections[_id_] = HTTPSConnection(self._host, timeout=5)
+        return conn
+
+    def _urlopen(self, _id_, full_url):
+        """GET `full_url` over the persistent connection of `_id_`, return (status, reason, body)"""
+        while True:
+            conn = self._get_connection(_id_)
+            reused = conn.sock is not None
+            try:
+                conn.request('GET', full_url)
+                resp = conn.getresponse()
+                return resp.status, resp.reason, resp.read()
+            except (HTTPException, OSError) as e:
+                # drop the broken connection
+                conn.close()
+                self._connections.pop(_id_, None)
+
+                # An idle keep-alive connection closed by the server is only noticed here.
+                # The message didn't get through, so reconnect once. Other errors like a timeout
+                # may happen after the server got the message, retrying would send it twice
+                if reused and isinstance(e, (RemoteDisconnected, BrokenPipeError, ConnectionResetError)):
+                    continue
+                raise
+
     def _request(self, _id_, full_url):
         """Return True if success or 403, otherwise False"""
         try:
-            with request.urlopen(full_url) as fi:
-                data = fi.read()
-            self.feedback[_id_] = json.loads(data.decode())
-            return True
-
-        except json.JSONDecodeError as e:
-            self.feedback[_id_] = {'error': str(e), 'data': data}
-            return True
-
-        except error.HTTPError as e:
-            if e.code == 403:
-                # user blocked the bot
-                logging.getLogger('logger_tt').error(e)
-                return True
-            if e.code == 429:
-                logging.getLogger('logger_tt').info(e)
-                time.sleep(1)
-                return False
-            else:
-                logging.getLogger('logger_tt').info(e)
-                return False
-
+            status, reason, data = self._urlopen(_id_, full_url)
         except ConnectionResetError as e:
             logging.getLogger('logger_tt').info(e)
             return False
@@ -184,22 +400,177 @@ class TelegramHandler(logging.Handler):
             logging.getLogger('logger_tt').exception(e)
             return False
 
-    def send(self):
-        for _id_ in self._unique_ids:
-            while self.cache[_id_]:
-                record = self.cache[_id_][0]
-                if isinstance(record, logging.LogRecord):
-                    msg_out = self.format(record)
-                else:
-                    msg_out = record[1]
+        if status == 403:
+            # user blocked the bot
+            logging.getLogger('logger_tt').error(f'HTTP Error {status}: {reason}')
+            return True
+        if status == 429:
+            logging.getLogger('logger_tt').info(f'HTTP Error {status}: {reason}')
+            time.sleep(1)
+            return False
+        if status >= 400:
+            logging.getLogger('logger_tt').info(f'HTTP Error {status}: {reason}')
+            return False
 
-                full_url = self._get_full_url(_id_, msg_out)
-                if self._request(_id_, full_url):
-                    self.cache[_id_].popleft()
-                else:
-                    # resend later
+        try:
+            self.feedback[_id_] = json.loads(data.decode())
+        except json.JSONDecodeError as e:
+            self.feedback[_id_] = {'error': str(e), 'data': data}
+        return True
+
+    def _message(self, items: list, i: int):
+        """Return the quoted text of items[i], or None if it can't be formatted.
+            Such record is reported and removed from the items
+        """
+        try:
+            return self._formatted(items[i])
+        except RecursionError:  # See issue 36272
+            raise
+        except Exception:
+            self.handleError(items[i])
+            items[i] = None
+
+    def _batches(self, items: list):
+        """Join the cached items into as few telegram messages as possible.
+            Yield the message and the index right after its last item
+        """
+        i, n = 0, len(items)
+        while i < n:
+            item = items[i]
+            i += 1
+            if not isinstance(item, logging.LogRecord):
+                # already grouped by msg_grouping
+                yield item[1], i
+                continue
+
+            msg = self._message(items, i - 1)
+            if msg is None:
+                continue
+
+            pieces = [msg]
+            length = len(msg)
+            while i < n and isinstance(items[i], logging.LogRecord):
+                msg = self._message(items, i)
+                if msg is None:
+                    i += 1
+                    continue
+
+                length += len(self.joiner) + len(msg)
+                if length > self.max_length:
                     break
 
+                pieces.append(msg)
+                i += 1
+
+            yield self.joiner.join(pieces), i
+
+    def _send_chat(self, _id_):
+        cache = self.cache[_id_]
+
+        # take out what is cached now, each popleft is atomic so emit can keep appending meanwhile
+        popleft = cache.popleft
+        items = [popleft() for _ in range(len(cache))]
+
+        sent = 0
+        try:
+            for msg_out, end in self._batches(items):
+                full_url = self._url_templates[_id_] % msg_out
+                if not self._request(_id_, full_url):
+                    break
+                sent = end
+        finally:
+            if sent < len(items):
+                # resend later, before the newer records
+                self._restore(cache, [item for item in items[sent:] if item is not None])
+
+    @staticmethod
+    def _restore(cache: deque, unsent: list):
+        """Put the unsent items back in front of the cache.
+            If they don't all fit, the oldest ones are dropped, as the cache does when it is full
+        """
+        room = cache.maxlen - len(cache) if cache.maxlen is not None else len(unsent)
+        if len(unsent) > room:
+            unsent = unsent[len(unsent) - room:] if room > 0 else []
+        cache.extendleft(reversed(unsent))
+
+    def send(self) -> bool:
+        """Send out the cache. Call it while holding self._sending.
+            Return False if some chats are still being sent after flush_timeout seconds.
+            Their records stay with that sending and are put back in the cache if it fails
+        """
+        # a chat left behind by the last timeout is still being sent, don't send it twice at the same time
+        self._chat_jobs = {_id_: job for _id_, job in self._chat_jobs.items() if not job.done()}
+        pending = [_id_ for _id_ in self._unique_ids if self.cache[_id_] and _id_ not in self._chat_jobs]
+
+        jobs, left = {}, pending
+        if len(pending) > 1:
+            # send each chat concurrently, on its own connection
+            left = []
+            for _id_ in pending:
+                try:
+                    jobs[_id_] = self._chat_pool.submit(self._send_chat, _id_)
+                except RuntimeError:
+                    # the thread pool takes no more work once the interpreter starts shutting down
+                    left.append(_id_)
+
+        # nothing to overlap, or the chats couldn't be sent concurrently
+        for _id_ in left:
+            try:
+                self._send_chat(_id_)
+            except Exception as e:
+                self._report_error(e)
+
+        # Don't wait forever: the sending threads may need self.lock to log a network error
+        # through this handler, and the caller may hold it, e.g. logging.shutdown
+        done, not_done = wait(jobs.values(), timeout=self.flush_timeout)
+        for job in done:
+            if job.exception():
+                self._report_error(job.exception())
+
+        self._chat_jobs.update((_id_, job) for _id_, job in jobs.items() if job in not_done)
+        return not self._chat_jobs
+
+    @staticmethod
+    def _report_error(error: BaseException):
+        """Print an unexpected sending error to stderr, like Handler.handleError does for a record"""
+        if logging.raiseExceptions and sys.stderr:
+            sys.stderr.write('--- Logging error ---\n')
+            traceback.print_exception(type(error), error, error.__traceback__, file=sys.stderr)
+
+    def _drain(self):
+        """Send out the cache unless another thread is sending.
+            That thread checks _pending again when it is done.
+        """
+        while self._pending and self._sending.acquire(blocking=False):
+            try:
+                self._pending = False
+                self.send()
+            finally:
+                self._sending.release()
+
+    def flush(self) -> bool:
+        """Send out the cache now, after the ongoing sending if any.
+            Return False if the ongoing sending or this one didn't finish in time
+        """
+        # Don't wait forever: logging.shutdown calls this while holding self.lock
+        # and the sending thread may need it to log a network error through this handler
+        if not self._sending.acquire(timeout=self.flush_timeout):
+            logging.getLogger('logger_tt').warning(f'TelegramHandler: another thread is still sending after '
+                                                   f'{self.flush_timeout} seconds, the cache is not flushed')
+            return False
+
+        try:
+            self._pending = False
+            finished = self.send()
+        finally:
+            self._sending.release()
+        self._drain()
+
+        if not finished:
+            logging.getLogger('logger_tt').warning(f'TelegramHandler: some chats are still being sent after '
+                                                   f'{self.flush_timeout} seconds')
+        return finished
+
     def msg_grouping(self):
         for _id_ in self._unique_ids:
             group = {}
@@ -209,7 +580,7 @@ class TelegramHandler(logging.Handler):
 
                 if isinstance(record, logging.LogRecord):
                     sec_timestamp = int(record.created)
-                    msg = self.format(record)
+                    msg = self._formatted(record)
                 else:
                     sec_timestamp, msg = record
                     group[sec_timestamp] = msg
@@ -223,96 +594,95 @@ class TelegramHandler(logging.Handler):
                     group[starting].append(msg)
 
             for grp, item in group.items():
-                # parse.quote_plus('\n') == %0A
-                msg_out = '%0A'.join(item)
+                msg_out = self.joiner.join(item)
                 self.cache[_id_].append((grp, msg_out))
 
-    def _is_duplicated_record(self, record):
-        if not self.last_record:
-            self.last_record = record
-            self.dup_count = 0
-            return False
-
-        for attr in 'msg name levelno pathname lineno args funcName'.split():
-            if getattr(record, attr) != getattr(self.last_record, attr):
-                return False
-        else:
-            return True
-
     def _cache_records(self, record):
         """cache msg in case of sending failure"""
 
         # redirect msg to appropriate cache
-        if getattr(record, 'dest_name', ''):
-            dest_id = next(filter(lambda x: x.startswith(f'{record.dest_name}:'), self._unique_ids), None)
-            if dest_id:
-                self.cache[dest_id].append(record)
-            else:
-                # do nothing
-                pass
+        dest_name = getattr(record, 'dest_name', '')
+        if dest_name:
+            dest_id = next(filter(lambda x: x.startswith(f'{dest_name}:'), self._unique_ids), None)
+            if not dest_id:
+                # nobody to send it to, no need to format it
+                return
+
+        # format it now: sending happens later, when the args of the record may have changed
+        self._formatted(record)
+
+        if dest_name:
+            self.cache[dest_id].append(record)
+        elif self._single_id:
+            self.cache[self._single_id].append(record)
         else:
             for _id_ in self._unique_ids:
                 self.cache[_id_].append(record)
 
     def emit(self, record):
-        self.acquire()
-
-        if self._is_duplicated_record(record):
-            self.dup_count += 1
-
-        elif self.dup_count:
-            # changed to new record, no longer duplicated
-            # send last msg, then send this time msg
-            self.last_record.remark = f'\n (Message repeated {self.dup_count} times)'
-            self._cache_records(self.last_record)
-            self._cache_records(record)
-
-            self.last_record = record
-            self.dup_count = 0
-            if not self.grouping_interval:
-                self.send()
-        else:
-            # last sent record is not duplicated
-            self._cache_records(record)
-            self.last_record = record
-            if not self.grouping_interval:
-                self.send()
+        try:
+            signature = record_signature(record)
+            if signature == self._last_signature:
+                self.dup_count += 1
+            else:
+                if self.dup_count:
+                    # changed to new record, no longer duplicated
+                    # send last msg, then send this time msg
+                    self._cache_records(self._repeated_record())
+                    self.dup_count = 0
+
+                self._cache_records(record)
+                self.last_record = record
+                self._last_signature = signature
+                if not self.grouping_interval and not self._pending:
+                    # don't wait for the network, let the executor send it
+                    self._pending = True
+                    try:
+                        self._executor.submit(self._drain)
+                    except RuntimeError:
+                        # handler is closed, keep the record in the cache
+                        pass
 
-        self.release()
+        except RecursionError:  # See issue 36272
+            raise
+        except Exception:
+            self.handleError(record)
 
     def interval_pusher(self):
-        if self.debug:
-            logging.getLogger().debug(f'TelegramHandler interval_pusher starts: {datetime.now()}')
-
-        while not self._stop_event.is_set():
-            time.sleep(self.push_interval)
-            if any(self.cache.values()):
-                self.acquire()
+        """
+        This method is called every push_interval seconds on the background loop
+        to group the cached messages and send them out
+        """
+        if any(self.cache.values()):
+            with self.lock:
                 self.msg_grouping()
-                self.send()
-                self.release()
+            self.flush()
+
+    def _cache_repeated(self):
+        with self.lock:
+            self._cache_records(self._repeated_record())
+            self.dup_count = 0
 
     def watcher(self):
         """
-        This method will resend the failed messages if they haven't been sent in emit
+        This method is called every check_interval seconds on the background loop
+        to resend the failed messages if they haven't been sent in emit
         """
-        if self.debug:
-            logging.getLogger().debug(f'TelegramHandler watcher starts: {datetime.now()}')
-
-        while not self._stop_event.is_set():
-            time.sleep(self.check_interval)
-            if any(self.cache.values()) and not self.grouping_interval:
-                if self.debug:
-                    logging.getLogger().debug(f'TelegramHandler found unsent messages: {datetime.now()}')
-                self.acquire()
-                self.send()
-                self.release()
-            elif self.dup_count > 1:
-                if self.debug:
-                    logging.getLogger().debug(f'TelegramHandler watcher emit duplicated msg with: {datetime.now()}')
-                self.acquire()
-                self.last_record.remark = f'\n (Message repeated {self.dup_count} times)'
-                self._cache_records(self.last_record)
-                self.send()
-                self.dup_count = 0
-                self.release()
+        self._check()
+
+    def _check_plain(self):
+        if any(self.cache.values()) and not self.grouping_interval:
+            self.flush()
+        elif self.dup_count > 1:
+            self._cache_repeated()
+            self.flush()
+
+    def _check_debug(self):
+        """Same as _check_plain, also logs what it does"""
+        if any(self.cache.values()) and not self.grouping_interval:
+            logging.getLogger().debug(f'TelegramHandler found unsent messages: {datetime.now()}')
+            self.flush()
+        elif self.dup_count > 1:
+            logging.getLogger().debug(f'TelegramHandler watcher emit duplicated msg with: {datetime.now()}')
+            self._cache_repeated()
+            self.flush()
@@ -0,0 +1,23 @@
+import os
+import signal
+import sys
+import time
+from logging import getLogger, Formatter
+
+from logger_tt.handlers import StreamHandlerWithBuffer
+
+logger = getLogger(__name__)
+handler = StreamHandlerWithBuffer(stream=sys.stdout, buffer_time=60, buffer_lines=0)
+handler.setFormatter(Formatter(fmt="%(levelname)s: %(message)s"))
+logger.addHandler(handler)
+logger.propagate = False
+
+
+if __name__ == '__main__':
+    # these lines are only in the buffer, it would be flushed one minute later
+    for i in range(3):
+        logger.warning(f'buffered line {i}')
+
+    os.kill(os.getpid(), signal.SIGTERM)
+    time.sleep(5)
+    logger.warning('should not be reached')
@@ -1,15 +1,60 @@
 import datetime
+import logging
 import os
+import socket
 import re
+import signal
+import sys
 import time
 
-from io import StringIO, BytesIO
+from http.client import RemoteDisconnected
+from io import StringIO
 from logging import getLogger, DEBUG, Formatter
+from subprocess import run
 
 import pytest
+from logger_tt import handlers, _bg
 from logger_tt.handlers import StreamHandlerWithBuffer, TelegramHandler, parse
 
 
+class FakeResponse:
+    def __init__(self, status, body=b''):
+        self.status = status
+        self.reason = 'fake_url raised error'
+        self.body = body
+
+    def read(self):
+        return self.body
+
+
+def fake_connection(get_code, log_sent=None, unquote=False, delay=0.0):
+    """Stub of HTTPSConnection. `get_code` returns the status code the server should reply"""
+
+    class FakeConnection:
+        def __init__(self, host, *args, **kwargs):
+            self.host = host
+            self.url = ''
+            self.sock = None
+
+        def request(self, method, url, *args, **kwargs):
+            self.sock = True
+            self.url = f'https://{self.host}{url}'
+
+        def getresponse(self):
+            time.sleep(delay)
+            code = get_code()
+            if code != 200:
+                return FakeResponse(code)
+            if log_sent is not None:
+                log_sent.write((parse.unquote_plus(self.url) if unquote else self.url) + '\n\n')
+            return FakeResponse(200, b'{"ok": "true"}\n')
+
+        def close(self):
+            pass
+
+    return FakeConnection
+
+
 @pytest.mark.parametrize('threshold', [0.2, 0.4])
 def test_handler_with_buffer_time(caplog, threshold):
     logger = getLogger('Test buffer time')
@@ -98,10 +143,12 @@ def test_telegram_handler_basic(unique_id):
 
     try:
         logger.warning('this is my warning')
+        handler.flush()
         feedback = handler.feedback[unique_id]
         assert feedback.get('ok')
 
         logger.error('this is my error \n this is the next line')
+        handler.flush()
         feedback = handler.feedback[unique_id]
         assert feedback.get('ok')
     finally:
@@ -110,7 +157,7 @@ def test_telegram_handler_basic(unique_id):
         handler.close()
 
 
-def test_telegram_handler_error(caplog):
+def test_telegram_handler_error(caplog, monkeypatch):
     bot_token = ''
     user_id = '123456789'
     logger = getLogger('test telegram 0')
@@ -119,47 +166,43 @@ def test_telegram_handler_error(caplog):
     handler.setFormatter(formatter)
     logger.addHandler(handler)
     logger.propagate = False
-    getLogger().setLevel(0)
-
-    # setup stub function
-    from urllib import request, error
 
-    def fake_urlopen(*arg, **kwargs):
-        if code != 200:
-            raise error.HTTPError('fake_url', code=code, msg='fake_url raised error', hdrs={}, fp=None)
-        else:
-            my_stream = BytesIO()
-            my_stream.write(b'{"ok": "true"}')
-            my_stream.seek(0)
-            return my_stream
+    try:
+        getLogger().setLevel(0)
 
-    request.urlopen = fake_urlopen
-    # stub done
+        # setup stub function
+        monkeypatch.setattr(handlers, 'HTTPSConnection', fake_connection(lambda: code))
+        # stub done
 
-    code = 403
-    logger.warning('user blocked this bot')
-    assert 'HTTP Error 403' in caplog.text
-    assert not handler.cache[user_id]
+        code = 403
+        logger.warning('user blocked this bot')
+        handler.flush()
+        assert 'HTTP Error 403' in caplog.text
+        assert not handler.cache[user_id]
 
-    code = 500
-    logger.error('server error')
-    assert handler.cache[user_id]
-    code = 200
+        code = 500
+        logger.error('server error')
+        handler.flush()
+        assert handler.cache[user_id]
+        code = 200
 
-    for retry in range(2):
-        try:
-            time.sleep(1.5)
+        for retry in range(2):
+            try:
+                time.sleep(1.5)
+                assert not handler.cache[user_id]
+                break
+            except AssertionError:
+                continue
+        else:
             assert not handler.cache[user_id]
-            break
-        except AssertionError:
-            continue
-    else:
-        assert not handler.cache[user_id]
-    assert 'HTTP Error 500' in caplog.text
-    assert 'found unsent messages' in caplog.text
+        assert 'HTTP Error 500' in caplog.text
+        assert 'found unsent messages' in caplog.text
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
 
 
-def test_telegram_handler_repeated_msg_continuous(caplog):
+def test_telegram_handler_repeated_msg_continuous(caplog, monkeypatch):
     bot_token = ''
     user_id = '123456789'
     logger = getLogger('test telegram 1')
@@ -168,40 +211,33 @@ def test_telegram_handler_repeated_msg_continuous(caplog):
     handler.setFormatter(formatter)
     logger.addHandler(handler)
     logger.propagate = False
-    getLogger().setLevel(0)
 
-    # setup
-    from urllib import request, error
-    code = 200
-    log_sent = StringIO()
-
-    def fake_urlopen(url: str, *args, **kwargs):
-        if code != 200:
-            raise error.HTTPError('fake_url', code=code, msg='fake_url raised error', hdrs={}, fp=None)
-        else:
-            log_sent.write(url+'\n\n')
-            my_stream = BytesIO()
-            my_stream.write('{"ok": "true"}\n'.encode())
-            my_stream.seek(0)
-            return my_stream
-
-    request.urlopen = fake_urlopen
-
-    # run repeat the same message continuously
-    for i in range(1000):
-        logger.warning(f'Connection error: server 500. Retry')
-    time.sleep(2)   # let watcher run
-
-    # check result
-    log_sent.seek(0)
-    data = log_sent.read()
-    count = data.count('Connection+error')
-    assert count < 500
-    res = re.findall(r'Message\+repeated\+(\d+)\+times', data)
-    assert sum(int(x) for x in res) == 1000 - 1, data + '\n\n' + caplog.text
+    try:
+        getLogger().setLevel(0)
+
+        # setup
+        code = 200
+        log_sent = StringIO()
+        monkeypatch.setattr(handlers, 'HTTPSConnection', fake_connection(lambda: code, log_sent))
+
+        # run repeat the same message continuously
+        for i in range(1000):
+            logger.warning(f'Connection error: server 500. Retry')
+        time.sleep(2)   # let watcher run
+
+        # check result
+        log_sent.seek(0)
+        data = log_sent.read()
+        count = data.count('Connection+error')
+        assert count < 500
+        res = re.findall(r'Message\+repeated\+(\d+)\+times', data)
+        assert sum(int(x) for x in res) == 1000 - 1, data + '\n\n' + caplog.text
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
 
 
-def test_telegram_handler_repeated_msg_then_change(caplog):
+def test_telegram_handler_repeated_msg_then_change(caplog, monkeypatch):
     bot_token = ''
     user_id = '123456789'
     logger = getLogger('test telegram 2')
@@ -210,46 +246,38 @@ def test_telegram_handler_repeated_msg_then_change(caplog):
     handler.setFormatter(formatter)
     logger.addHandler(handler)
     logger.propagate = False
-    getLogger().setLevel(0)
 
-    # setup
-    from urllib import request, error
-    code = 200
-    log_sent = StringIO()
+    try:
+        getLogger().setLevel(0)
 
-    def fake_urlopen(url: str, *args, **kwargs):
-        if code != 200:
-            raise error.HTTPError('fake_url', code=code, msg='fake_url raised error', hdrs={}, fp=None)
+        # setup
+        code = 200
+        log_sent = StringIO()
+        monkeypatch.setattr(handlers, 'HTTPSConnection', fake_connection(lambda: code, log_sent))
+
+        # run repeat the same message for a while then different message
+        for i in range(10):
+            logger.warning(f'Connection error: server 500. Retry')
         else:
-            log_sent.write(url+'\n\n')
-            my_stream = BytesIO()
-            my_stream.write('{"ok": "true"}\n'.encode())
-            my_stream.seek(0)
-            return my_stream
+            logger.error(f'Failure. Memory overflow')
+        time.sleep(2)   # let watcher run
+
+        # check result, watcher should have nothing to do
+        log_sent.seek(0)
+        data = log_sent.read()
+        count = data.count('Connection+error')
+        assert 1 < count < 6, data + '\n\n' + caplog.text
+        res = re.findall(r'Message\+repeated\+(\d+)\+times', data)
+        assert 'Message+repeated+9+times' in data
+        assert sum(int(x) for x in res) == 10 - len(res), data + '\n\n' + caplog.text
+        assert 'Memory+overflow' in data
+        assert 'watcher emit duplicated' not in caplog.text
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
 
-    request.urlopen = fake_urlopen
 
-    # run repeat the same message for a while then different message
-    log_sent = StringIO()
-    for i in range(10):
-        logger.warning(f'Connection error: server 500. Retry')
-    else:
-        logger.error(f'Failure. Memory overflow')
-    time.sleep(2)   # let watcher run
-
-    # check result, watcher should have nothing to do
-    log_sent.seek(0)
-    data = log_sent.read()
-    count = data.count('Connection+error')
-    assert 1 < count < 6, data + '\n\n' + caplog.text
-    res = re.findall(r'Message\+repeated\+(\d+)\+times', data)
-    assert 'Message+repeated+9+times' in data
-    assert sum(int(x) for x in res) == 10 - len(res), data + '\n\n' + caplog.text
-    assert 'Memory+overflow' in data
-    assert 'watcher emit duplicated' not in caplog.text
-
-
-def test_telegram_handler_grouping_msg(caplog):
+def test_telegram_handler_grouping_msg(caplog, monkeypatch):
     bot_token = ''
     user_id = '123456789'
     logger = getLogger('test telegram 3')
@@ -258,43 +286,531 @@ def test_telegram_handler_grouping_msg(caplog):
     handler.setFormatter(formatter)
     logger.addHandler(handler)
     logger.propagate = False
-    getLogger().setLevel(0)
 
-    # setup
-    from urllib import request, error
-    code = 200
-    log_sent = StringIO()
+    try:
+        getLogger().setLevel(0)
+
+        # setup
+        code = 200
+        log_sent = StringIO()
+        monkeypatch.setattr(handlers, 'HTTPSConnection', fake_connection(lambda: code, log_sent, unquote=True))
 
-    def fake_urlopen(url: str, *args, **kwargs):
-        if code != 200:
-            raise error.HTTPError('fake_url', code=code, msg='fake_url raised error', hdrs={}, fp=None)
+        # run repeat the same message for a while then different message
+        for i in range(10):
+            # first group
+            logger.warning(f'Connection error: server 500. Retry {i+1} time')
         else:
-            log_sent.write(parse.unquote_plus(url)+'\n\n')
-            my_stream = BytesIO()
-            my_stream.write('{"ok": "true"}\n'.encode())
-            my_stream.seek(0)
-            return my_stream
+            # second group
+            time.sleep(1)
+            logger.error(f'Failure. Memory overflow')
+
+            # third group
+            time.sleep(1)
+            logger.error(f'Failure. Hard disk is at capacity')
+
+        time.sleep(4)   # let watcher run
+
+        log_sent.seek(0)
+        data = log_sent.read()
+        count = data.count('https')
+        print(data)
+        assert count == 3, 'There should be 3 groups of http request'
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+
+def test_telegram_handler_batch_unsent_msg(caplog, monkeypatch):
+    bot_token = ''
+    user_id = '123456789'
+    logger = getLogger('test telegram 4')
+    handler = TelegramHandler(token=bot_token, unique_ids=user_id, check_interval=60)
+    formatter = Formatter(fmt="%(levelname)s: %(message)s")
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+    logger.propagate = False
+
+    try:
+        # setup
+        code = 500
+        log_sent = StringIO()
+        monkeypatch.setattr(handlers, 'HTTPSConnection', fake_connection(lambda: code, log_sent, unquote=True))
+
+        # network is down, all messages are cached
+        for i in range(5):
+            logger.error(f'Failure number {i}')
+        handler.flush()
+        assert len(handler.cache[user_id]) == 5
+
+        # network is back, cached messages are sent in one request
+        code = 200
+        handler.flush()
+        assert not handler.cache[user_id]
+
+        log_sent.seek(0)
+        data = log_sent.read()
+        assert data.count('https') == 1, data
+        assert '\n'.join([f'ERROR: Failure number {i}' for i in range(5)]) in data
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+
+def test_telegram_handler_multiple_chats_concurrently(caplog, monkeypatch):
+    bot_token = ''
+    user_ids = '123456789; 223456789; 323456789'
+    logger = getLogger('test telegram 5')
+    handler = TelegramHandler(token=bot_token, unique_ids=user_ids, check_interval=60)
+    formatter = Formatter(fmt="%(levelname)s: %(message)s")
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+    logger.propagate = False
+
+    try:
+        # setup
+        log_sent = StringIO()
+        monkeypatch.setattr(handlers, 'HTTPSConnection', fake_connection(lambda: 200, log_sent, delay=0.3))
+
+        t0 = time.time()
+        logger.error('Failure. Memory overflow')
+        handler.flush()
+        dt = time.time() - t0
+
+        log_sent.seek(0)
+        data = log_sent.read()
+        for user_id in user_ids.split('; '):
+            assert f'chat_id={user_id}&' in data
+        assert dt < 0.6, "Chats should be sent concurrently"
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+
+def test_telegram_handler_multiple_chats_at_shutdown(caplog, monkeypatch):
+    bot_token = ''
+    user_ids = '123456789; 223456789'
+    logger = getLogger('test telegram 9')
+    handler = TelegramHandler(token=bot_token, unique_ids=user_ids, check_interval=60)
+    logger.addHandler(handler)
+    logger.propagate = False
+
+    try:
+        # setup
+        code = 500
+        log_sent = StringIO()
+        monkeypatch.setattr(handlers, 'HTTPSConnection', fake_connection(lambda: code, log_sent))
+
+        # network is down, the message is cached for both chats
+        logger.error('Failure. Memory overflow')
+        handler.flush()
+        assert all(handler.cache.values())
+
+        # the interpreter is shutting down: thread pools don't take new work anymore
+        def refuse(*args):
+            raise RuntimeError('cannot schedule new futures after interpreter shutdown')
+
+        monkeypatch.setattr(handler._chat_pool, 'submit', refuse)
+        code = 200
+        handler.flush()
+
+        data = log_sent.getvalue()
+        for user_id in user_ids.split('; '):
+            assert f'chat_id={user_id}&' in data
+        assert not any(handler.cache.values())
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+
+def test_telegram_handler_emit_not_blocked(caplog, monkeypatch):
+    bot_token = ''
+    user_id = '123456789'
+    logger = getLogger('test telegram 6')
+    handler = TelegramHandler(token=bot_token, unique_ids=user_id, check_interval=60)
+    logger.addHandler(handler)
+    logger.propagate = False
+
+    try:
+        # setup
+        log_sent = StringIO()
+        monkeypatch.setattr(handlers, 'HTTPSConnection', fake_connection(lambda: 200, log_sent, delay=0.5))
+
+        t0 = time.time()
+        logger.error('Failure. Memory overflow')
+        dt = time.time() - t0
+        assert dt < 0.1, "emit should return without waiting for the network"
+
+        handler.flush()
+        log_sent.seek(0)
+        assert 'Memory+overflow' in log_sent.read()
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+
+def test_handler_with_buffer_flush_and_close():
+    logger = getLogger('Test buffer close')
+    my_stream = StringIO()
+    handler = StreamHandlerWithBuffer(stream=my_stream, buffer_time=60, buffer_lines=0)
+    logger.addHandler(handler)
+    logger.propagate = False
+
+    for i in range(3):
+        logger.warning(f'buffered line {i}')
+    assert not my_stream.getvalue()
 
-    request.urlopen = fake_urlopen
+    # logging.shutdown and dictConfig call flush() then close()
+    handler.flush()
+    assert my_stream.getvalue().splitlines() == [f'buffered line {i}' for i in range(3)]
 
-    # run repeat the same message for a while then different message
+    logger.warning('last line')
+    handler.close()
+    assert my_stream.getvalue().splitlines()[-1] == 'last line'
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='SIGTERM cannot be caught on Windows')
+def test_handler_with_buffer_flush_on_sigterm():
+    cmd = [sys.executable, "buffer_sigterm.py"]
+    result = run(cmd, capture_output=True, text=True, timeout=10)
+
+    assert result.returncode == -signal.SIGTERM, "Still terminated by the signal"
+    assert result.stdout.splitlines() == [f'WARNING: buffered line {i}' for i in range(3)]
+
+
+def flaky_connection(error, log_sent):
+    """Stub of HTTPSConnection whose connection fails with `error` when it is reused"""
+
+    class FlakyConnection:
+        opened = 0
+
+        def __init__(self, host, *args, **kwargs):
+            self.host = host
+            self.url = ''
+            self.sock = None
+            FlakyConnection.opened += 1
+
+        def request(self, method, url, *args, **kwargs):
+            if self.sock:
+                raise error
+            self.sock = True
+            self.url = f'https://{self.host}{url}'
+
+        def getresponse(self):
+            log_sent.write(self.url + '\n\n')
+            return FakeResponse(200, b'{"ok": "true"}\n')
+
+        def close(self):
+            self.sock = None
+
+    return FlakyConnection
+
+
+def test_telegram_handler_reconnect(caplog, monkeypatch):
+    user_id = '123456789'
+    logger = getLogger('test telegram 7')
+    handler = TelegramHandler(token='', unique_ids=user_id, check_interval=60)
+    logger.addHandler(handler)
+    logger.propagate = False
+
+    try:
+        # setup: the server closes the idle keep-alive connection
+        log_sent = StringIO()
+        conn_cls = flaky_connection(RemoteDisconnected('closed'), log_sent)
+        monkeypatch.setattr(handlers, 'HTTPSConnection', conn_cls)
+
+        logger.error('first message')
+        handler.flush()
+        logger.error('second message')
+        handler.flush()
+
+        data = log_sent.getvalue()
+        assert data.count('first+message') == 1
+        assert data.count('second+message') == 1
+        assert conn_cls.opened == 2, "A new connection should replace the closed one"
+        assert not handler.cache[user_id]
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+
+def test_telegram_handler_no_resend_on_timeout(caplog, monkeypatch):
+    user_id = '123456789'
+    logger = getLogger('test telegram 8')
+    handler = TelegramHandler(token='', unique_ids=user_id, check_interval=60)
+    logger.addHandler(handler)
+    logger.propagate = False
+
+    try:
+        # setup: the server may have got the message before the timeout
+        log_sent = StringIO()
+        conn_cls = flaky_connection(socket.timeout('timed out'), log_sent)
+        monkeypatch.setattr(handlers, 'HTTPSConnection', conn_cls)
+
+        logger.error('first message')
+        handler.flush()
+        logger.error('second message')
+        handler.flush()
+
+        assert conn_cls.opened == 1, "A timeout should not be retried at once"
+        assert [r.msg for r in handler.cache[user_id]] == ['second message'], "It is kept for the next sending"
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+
+@pytest.mark.parametrize('text', ['', 'simple text', ''.join(map(chr, range(128))),
+                                  'Tiếng Việt có dấu', '日本語のテキスト', 'emoji 🐍 and\nnew line', '50% off & more=+'])
+def test_quote_plus(text):
+    assert handlers.quote_plus(text) == parse.quote_plus(text)
+    assert handlers.quote_plus(text) == parse.quote_plus(text), "Cached non-ascii characters give the same result"
+
+
+def test_quote_plus_cache_bounded():
+    handlers.quote_plus('🐍 \U0010fffd')
+    assert ord('🐍') not in handlers._QUOTE_PLUS_ALL
+    assert 0x10fffd not in handlers._QUOTE_PLUS_ALL
+    handlers.quote_plus('ệ')
+    assert ord('ệ') in handlers._QUOTE_PLUS_ALL
+
+
+def test_telegram_handler_format_at_emit(caplog, monkeypatch):
+    user_id = '123456789'
+    logger = getLogger('test telegram 10')
+    handler = TelegramHandler(token='', unique_ids=user_id, check_interval=60)
+    handler.setFormatter(Formatter(fmt="%(levelname)s: %(message)s"))
+    logger.addHandler(handler)
+    logger.propagate = False
+
+    try:
+        # setup: network is down
+        code = 500
+        log_sent = StringIO()
+        monkeypatch.setattr(handlers, 'HTTPSConnection', fake_connection(lambda: code, log_sent, unquote=True))
+        errors = []
+        monkeypatch.setattr(handler, 'handleError', errors.append)
+
+        state = {'state': 'before'}
+        logger.error('good 1')
+        logger.error('state %s', state)
+        state['state'] = 'after'
+        logger.error('bad %d', 'x')
+        logger.error('good 2')
+        handler.flush()
+        assert [r.msg for r in errors] == ['bad %d'], "Format error is reported in emit"
+        assert len(handler.cache[user_id]) == 3
+
+        # network is back
+        code = 200
+        handler.flush()
+        data = log_sent.getvalue()
+        assert "ERROR: good 1\nERROR: state {'state': 'before'}\nERROR: good 2" in data
+        assert not handler.cache[user_id]
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+
+def test_telegram_handler_flush_timeout(caplog, monkeypatch):
+    user_id = '123456789'
+    logger = getLogger('test telegram 11')
+    handler = TelegramHandler(token='', unique_ids=user_id, check_interval=60)
+    handler.flush_timeout = 0.1
+    logger.addHandler(handler)
+    logger.propagate = False
+
+    try:
+        # setup
+        log_sent = StringIO()
+        monkeypatch.setattr(handlers, 'HTTPSConnection', fake_connection(lambda: 200, log_sent))
+
+        with handler._sending:
+            # another thread is sending
+            logger.error('Failure. Memory overflow')
+            assert handler.flush() is False
+            assert len(handler.cache[user_id]) == 1
+            assert 'cache is not flushed' in caplog.text
+
+        assert handler.flush() is True
+        assert not handler.cache[user_id]
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+
+def test_telegram_handler_unsent_kept_on_error(caplog, monkeypatch):
+    user_id = '123456789'
+    logger = getLogger('test telegram 12')
+    handler = TelegramHandler(token='', unique_ids=user_id, check_interval=60)
+    handler.setFormatter(Formatter(fmt="%(levelname)s: %(message)s"))
+    logger.addHandler(handler)
+    logger.propagate = False
+
+    try:
+        # setup
+        log_sent = StringIO()
+        monkeypatch.setattr(handlers, 'HTTPSConnection', fake_connection(lambda: 200, log_sent, unquote=True))
+        errors = []
+        monkeypatch.setattr(handler, 'handleError', errors.append)
+
+        # a record that was never formatted and fails to
+        bad = logging.makeLogRecord({'msg': 'bad %d', 'args': ('x',), 'levelname': 'ERROR'})
+        for record in ['good 1', bad, 'good 2']:
+            if isinstance(record, str):
+                record = logging.makeLogRecord({'msg': record, 'levelname': 'ERROR'})
+            handler.cache[user_id].append(record)
+
+        # unexpected error while sending
+        def broken(*args):
+            raise ValueError('unexpected')
+
+        monkeypatch.setattr(handler, '_request', broken)
+        with pytest.raises(ValueError):
+            handler._send_chat(user_id)
+        assert [r.msg for r in errors] == ['bad %d']
+        assert [r.msg for r in handler.cache[user_id]] == ['good 1', 'good 2'], "Unsent records are kept"
+
+        monkeypatch.delattr(handler, '_request')
+        handler.flush()
+        assert 'ERROR: good 1\nERROR: good 2' in log_sent.getvalue()
+        assert not handler.cache[user_id]
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+
+def test_telegram_handler_full_cache_drops_oldest(caplog, monkeypatch):
+    user_id = '123456789'
+    monkeypatch.setattr(TelegramHandler, 'cache_size', 3)
+    logger = getLogger('test telegram 13')
+    handler = TelegramHandler(token='', unique_ids=user_id, check_interval=60)
+    logger.addHandler(handler)
+    logger.propagate = False
+
+    try:
+        cache = handler.cache[user_id]
+        for i in range(3):
+            cache.append(logging.makeLogRecord({'msg': f'msg {i}'}))
+
+        # new records come in while the sending fails
+        def failed(*args):
+            for i in range(3, 5):
+                cache.append(logging.makeLogRecord({'msg': f'msg {i}'}))
+            return False
+
+        monkeypatch.setattr(handler, '_request', failed)
+        handler._send_chat(user_id)
+        assert [r.msg for r in cache] == ['msg 2', 'msg 3', 'msg 4']
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+
+def test_handler_with_buffer_lines_unset():
+    logger = getLogger('Test buffer lines unset')
+    my_stream = StringIO()
+    handler = StreamHandlerWithBuffer(stream=my_stream, buffer_time=60, buffer_lines=0)
+    logger.addHandler(handler)
+    logger.propagate = False
+
+    # only the watcher or flush() write the lines out
+    for i in range(100):
+        logger.warning(f'line {i}')
+    assert not my_stream.getvalue()
+    handler.flush()
+    assert my_stream.getvalue().splitlines() == [f'line {i}' for i in range(100)]
+
+    # changed later, the number of lines is counted again
+    handler.buffer_lines = 5
+    for i in range(5):
+        logger.warning(f'counted line {i}')
+    assert my_stream.getvalue().splitlines()[-1] == 'counted line 4'
+    handler.close()
+
+
+def test_handler_with_buffer_subclass_emit():
+    class UpperHandler(StreamHandlerWithBuffer):
+        def emit(self, record):
+            record.msg = record.msg.upper()
+            super().emit(record)
+
+    logger = getLogger('Test buffer subclass')
+    my_stream = StringIO()
+    handler = UpperHandler(stream=my_stream, buffer_time=0, buffer_lines=1)
+    logger.addHandler(handler)
+    logger.propagate = False
+
+    logger.warning('shout')
+    assert my_stream.getvalue() == 'SHOUT\n'
+    handler.close()
+
+
+def test_telegram_handler_many_multiple_chats(caplog, monkeypatch):
+    user_ids = '123456789; 223456789'
+    logger = getLogger('test telegram 14')
+    logger.propagate = False
+
+    # setup: network is down
+    code = 500
     log_sent = StringIO()
-    for i in range(10):
-        # first group
-        logger.warning(f'Connection error: server 500. Retry {i+1} time')
-    else:
-        # second group
-        time.sleep(1)
-        logger.error(f'Failure. Memory overflow')
-
-        # third group
-        time.sleep(1)
-        logger.error(f'Failure. Hard disk is at capacity')
-        
-    time.sleep(4)   # let watcher run
-
-    log_sent.seek(0)
-    data = log_sent.read()
-    count = data.count('https')
-    print(data)
-    assert count == 3, 'There should be 3 groups of http request'
+    monkeypatch.setattr(handlers, 'HTTPSConnection', fake_connection(lambda: code, log_sent, delay=0.1))
+
+    # more multi-chat handlers than the periodic jobs have threads
+    telegram_handlers = [TelegramHandler(token='', unique_ids=user_ids, check_interval=1)
+                         for _ in range(_bg.PERIODIC_WORKERS + 2)]
+    my_stream = StringIO()
+    buffer_handler = StreamHandlerWithBuffer(stream=my_stream, buffer_time=0.5, buffer_lines=0)
+    try:
+        for handler in telegram_handlers:
+            logger.addHandler(handler)
+        logger.error('Failure. Memory overflow')
+        for handler in telegram_handlers:
+            handler.flush()
+        assert not log_sent.getvalue()
+
+        # network is back, the watchers resend everything
+        code = 200
+        expected = 2 * len(telegram_handlers)
+        for retry in range(6):
+            time.sleep(1)
+            if log_sent.getvalue().count('https') == expected:
+                break
+        assert log_sent.getvalue().count('https') == expected
+
+        # other handlers' periodic jobs still run
+        getLogger('test buffer with telegram').addHandler(buffer_handler)
+        getLogger('test buffer with telegram').warning('still flushed')
+        time.sleep(1.5)
+        assert my_stream.getvalue() == 'still flushed\n'
+    finally:
+        for handler in telegram_handlers:
+            logger.removeHandler(handler)
+            handler.close()
+        getLogger('test buffer with telegram').removeHandler(buffer_handler)
+        buffer_handler.close()
+
+
+def test_telegram_handler_flush_while_lock_held(caplog, monkeypatch):
+    user_ids = '123456789; 223456789'
+    logger = getLogger('logger_tt')
+    handler = TelegramHandler(token='', unique_ids=user_ids, check_interval=60)
+    handler.flush_timeout = 0.5
+    logger.addHandler(handler)
+
+    try:
+        # setup: the reply is logged through this handler by the sending threads
+        monkeypatch.setattr(handlers, 'HTTPSConnection', fake_connection(lambda: 403))
+
+        with handler.lock:
+            # like logging.shutdown
+            handler.cache['123456789'].append(logging.makeLogRecord({'msg': 'blocked'}))
+            handler.cache['223456789'].append(logging.makeLogRecord({'msg': 'blocked'}))
+            t0 = time.time()
+            assert handler.flush() is False
+            assert time.time() - t0 < 2, "flush should give up instead of waiting forever"
+
+        # the sending threads finish once the lock is released
+        time.sleep(0.5)
+        assert handler.flush() is True
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
@@ -255,3 +255,13 @@ def test_remove_unused_handlers():
     remove_unused_handlers(config)
     assert 'buffer_stream_handler' not in config['handlers']
     assert 'telegram_handler' not in config['handlers']
+
+
+def test_not_capture_uncaught():
+    previous_hook = sys.excepthook
+    sys.excepthook = sys.__excepthook__
+    try:
+        with setup_logging(capture_uncaught=False):
+            assert sys.excepthook is sys.__excepthook__
+    finally:
+        sys.excepthook = previous_hook